@@ -1,8 +1,31 @@
 import os
 import time
+import json
+import queue
+import sqlite3
+import hashlib
+import threading
 import requests
 import calendar
-from collections import defaultdict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import quote, urlsplit
+from contextlib import nullcontext
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import orjson  # fast JSON; responses are decoded from raw bytes
+    json_loads, json_dumps = orjson.loads, orjson.dumps
+except ImportError:
+    json_loads = json.loads
+    def json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False).encode()
+
+try:
+    import websocket  # websocket-client; optional, BTC falls back to REST polling without it
+except ImportError:
+    websocket = None
 
 # === ENV ===
 TG_TOKEN = os.getenv("BOT_TOKEN") or os.getenv("TELEGRAM_TOKEN")
@@ -13,8 +36,11 @@ ETH_ADDR_ENV = os.getenv("ETH_ADDRESS", "")
 TRON_ADDR_ENV = os.getenv("TRON_ADDRESS", "")
 BTC_ADDR_ENV = os.getenv("BTC_ADDRESS", "")
 
+ETH_ERC20 = os.getenv("ETH_ERC20", "false").lower() in ("1","true","yes","y")
 BTC_CONFIRM_UPDATE = os.getenv("BTC_CONFIRM_UPDATE", "true").lower() in ("1","true","yes","y")
 BTC_USE_FIRST_SEEN = os.getenv("BTC_USE_FIRST_SEEN", "false").lower() in ("1","true","yes","y")
+BTC_WEBSOCKET = os.getenv("BTC_WEBSOCKET", "true").lower() in ("1","true","yes","y")
+BTC_WS_URL = os.getenv("BTC_WS_URL", "wss://mempool.space/api/v1/ws")
 
 # Timezone for DISPLAY (+ optional cutoff in local)
 TIME_OFFSET_HOURS = int(os.getenv("TIME_OFFSET_HOURS", "0"))
@@ -34,9 +60,46 @@ ETH_CUTOFF_LOCAL = os.getenv("ETH_NOTIFY_AFTER_LOCAL", "").strip()
 TRON_CUTOFF_LOCAL = os.getenv("TRON_NOTIFY_AFTER_LOCAL", "").strip()
 
 SEEN_LIMIT = int(os.getenv("SEEN_LIMIT", "50"))
+# Per-wallet polling: start at POLL_INTERVAL, stretch by POLL_BACKOFF on idle cycles up to POLL_MAX_INTERVAL
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "5"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "60"))
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", "1.5"))
+STATE_DB = os.getenv("STATE_DB", "state.db")
+STATE_PRUNE_SEC = int(os.getenv("STATE_PRUNE_SEC", "3600"))
+PRICE_CACHE_TTL = int(os.getenv("PRICE_CACHE_TTL", "30"))
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "16"))
+ETHERSCAN_CONCURRENCY = int(os.getenv("ETHERSCAN_CONCURRENCY", "4"))  # free tier allows ~5 calls/s
+TG_COALESCE_SEC = float(os.getenv("TG_COALESCE_SEC", "0.5"))
+# Re-scan this many blocks below the cursor; Etherscan's txlist index can trail eth_blockNumber
+ETH_BLOCK_OVERLAP = int(os.getenv("ETH_BLOCK_OVERLAP", "3"))
+# newest txs per txlist/tokentx page; the block cursor keeps ranges short, this caps the first (full-history) scan
+ETH_PAGE_SIZE = int(os.getenv("ETH_PAGE_SIZE", "25"))
+ERROR_LOG_SEC = int(os.getenv("ERROR_LOG_SEC", "60"))
 
 # === Helpers ===
-def parse_addresses(env_value):
+# _error_log[tag] = (last printed monotonic time, repeats suppressed since); one line per tag per ERROR_LOG_SEC
+_error_log = {}
+_error_log_lock = threading.Lock()
+
+def log_error(tag, e):
+    """print(tag, e), but at most once per ERROR_LOG_SEC for the same tag so an outage does not flood stdout."""
+    now = time.monotonic()
+    with _error_log_lock:
+        last, suppressed = _error_log.get(tag, (None, 0))
+        if last is not None and now - last < ERROR_LOG_SEC:
+            _error_log[tag] = (last, suppressed + 1)
+            return
+        _error_log[tag] = (now, 0)
+    if suppressed:
+        print(f"{tag}: {e} ({suppressed} similar suppressed)")
+    else:
+        print(f"{tag}: {e}")
+
+def parse_addresses(env_value, lowercase=False):
+    """
+    Parse 'addr[:label],...' once at startup. Addresses come back stripped (entries without one
+    are dropped) and, with lowercase=True (hex ETH addresses), lowercased for direct comparison.
+    """
     result = []
     for raw in env_value.split(","):
         raw = raw.strip()
@@ -44,29 +107,237 @@ def parse_addresses(env_value):
             continue
         if ":" in raw:
             addr, label = raw.split(":", 1)
-            result.append({"address": addr.strip(), "label": label.strip()})
+            addr, label = addr.strip(), label.strip()
         else:
-            result.append({"address": raw, "label": ""})
-    return result
+            addr, label = raw, ""
+        if not addr:
+            continue
+        result.append({"address": addr.lower() if lowercase else addr, "label": label})
+    return tuple(result)
 
-ETH_ADDRESSES = parse_addresses(ETH_ADDR_ENV)
+ETH_ADDRESSES = parse_addresses(ETH_ADDR_ENV, lowercase=True)
 TRON_ADDRESSES = parse_addresses(TRON_ADDR_ENV)
 BTC_ADDRESSES = parse_addresses(BTC_ADDR_ENV)
-
-def send_message(msg):
-    url = f"https://api.telegram.org/bot{TG_TOKEN}/sendMessage"
-    data = {"chat_id": TG_CHAT_ID, "text": msg, "parse_mode": "Markdown"}
-    try:
-        requests.post(url, data=data, timeout=10)
-    except Exception as e:
-        print("Telegram Error:", e)
-
-def get_price(symbol):
+# BTC_LABELS[address] = labels in config order (a wallet may be listed under several); BTC_WALLETS = distinct addresses
+BTC_LABELS = {}
+for _item in BTC_ADDRESSES:
+    BTC_LABELS.setdefault(_item["address"], []).append(_item["label"])
+BTC_WALLETS = tuple(BTC_LABELS)
+
+# Shared pool for the per-cycle fetch fan-out (all work is network I/O)
+EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="wallet")
+
+# Alerts are delivered by one background sender so Telegram latency never stalls polling
+_tg_queue = queue.Queue()  # (text, seen rows it carries)
+# seen rows whose alert Telegram accepted; only these are persisted, so a restart re-sends anything still queued
+_tg_delivered = queue.Queue()
+
+# === HTTP ===
+# One keep-alive pool per upstream, sized for how many threads hit it at once
+_WALLET_POOL = max(MAX_WORKERS, 1)
+UPSTREAM_POOLS = {
+    "https://api.etherscan.io": _WALLET_POOL,
+    "https://api.trongrid.io": _WALLET_POOL,
+    "https://mempool.space": _WALLET_POOL,
+    "https://api.binance.com": 2,
+    "https://api.telegram.org": 2,
+}
+
+def mk_session():
+    s = requests.Session()
+    retries = Retry(total=2, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504))
+    s.mount("https://", HTTPAdapter(max_retries=retries))
+    for prefix, size in UPSTREAM_POOLS.items():
+        s.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=retries))
+    return s
+
+SESSION = mk_session()
+
+TG_URL = f"https://api.telegram.org/bot{TG_TOKEN}/sendMessage"
+TG_MAX_LEN = 4096  # Telegram's sendMessage text limit
+# URL, headers and adapter are resolved once; each send only swaps in the body
+TG_REQUEST = SESSION.prepare_request(requests.Request("POST", TG_URL, headers={"Content-Type": "application/json"}))
+
+def _post_telegram(msg, parse_mode="Markdown"):
+    """POST one sendMessage; returns the final HTTP status (0 if the request itself failed)."""
+    payload = {"chat_id": TG_CHAT_ID, "text": msg}
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    req = TG_REQUEST.copy()
+    req.body = json_dumps(payload)
+    req.headers["Content-Length"] = str(len(req.body))
+    for _ in range(3):
+        try:
+            r = SESSION.send(req, timeout=10)
+        except Exception as e:
+            log_error("Telegram Error", e)
+            return 0
+        if r.status_code != 429:
+            if r.status_code >= 300:
+                log_error("Telegram Error", f"HTTP {r.status_code}: {r.text[:200]}")
+            return r.status_code
+        # flood control: Telegram says how long to back off (a proxy's 429 may not be Telegram JSON)
+        try:
+            retry_after = float(json_loads(r.content)["parameters"]["retry_after"])
+        except Exception:
+            retry_after = _retry_after_sec(r)
+        time.sleep(retry_after)
+    log_error("Telegram Error", "still rate limited after 3 attempts, message dropped")
+    return 429
+
+def _deliver(parts):
+    status = _post_telegram("\n\n".join(msg for msg, _ in parts))
+    if 200 <= status < 300:
+        for _, rows in parts:
+            for row in rows:
+                _tg_delivered.put(row)
+        return
+    if status == 429 or not 400 <= status < 500:
+        return
+    # a rejected batch (e.g. stray Markdown in a label or token symbol) must not take the other alerts down
+    if len(parts) > 1:
+        for part in parts:
+            _deliver([part])
+    elif 200 <= _post_telegram(parts[0][0], parse_mode=None) < 300:  # plain text still carries the alert
+        for row in parts[0][1]:
+            _tg_delivered.put(row)
+
+def _telegram_sender():
+    """Post queued alerts, merging those that arrive within TG_COALESCE_SEC into one message."""
+    pending = None
+    while True:
+        parts = [pending if pending is not None else _tg_queue.get()]
+        size = len(parts[0][0])
+        pending = None
+        deadline = time.monotonic() + TG_COALESCE_SEC
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                nxt = _tg_queue.get(timeout=left)
+            except queue.Empty:
+                break
+            if size + 2 + len(nxt[0]) > TG_MAX_LEN:
+                pending = nxt  # starts the next message
+                break
+            parts.append(nxt)
+            size += 2 + len(nxt[0])
+        try:
+            _deliver(parts)
+        except Exception as e:  # one bad response must not end delivery for the rest of the run
+            log_error("Telegram Error", e)
+
+# _tg_undelivered[(chain, addr)] = queued alerts Telegram has not accepted yet; main thread only
+_tg_undelivered = defaultdict(int)
+
+def send_message(msg, rows=()):
+    """Queue msg for the background Telegram sender; rows are persisted once it is delivered."""
+    for row in rows:
+        _tg_undelivered[(row[0], row[1])] += 1
+    _tg_queue.put((msg, rows))
+
+def tg_delivered_rows():
+    """Seen rows (chain, addr, txid, confirmed, ts) delivered since the last call."""
+    rows = []
+    while True:
+        try:
+            row = _tg_delivered.get_nowait()
+        except queue.Empty:
+            return rows
+        rows.append(row)
+        key = (row[0], row[1])
+        _tg_undelivered[key] -= 1
+        if _tg_undelivered[key] <= 0:
+            del _tg_undelivered[key]
+
+# _host_cooldown[host] = monotonic time before which the host asked us (429 Retry-After) not to call again
+_host_cooldown = {}
+
+def _retry_after_sec(r, default=1):
     try:
-        r = requests.get(f"https://api.binance.com/api/v3/ticker/price?symbol={symbol}", timeout=10).json()
-        return float(r["price"])
-    except Exception:
-        return 0.0
+        return max(float(r.headers.get("Retry-After", default)), 0)
+    except ValueError:  # HTTP-date form; not worth parsing for a backoff hint
+        return default
+
+# Cap in-flight requests per host so a wide wallet fan-out queues locally instead of tripping rate limits
+HOST_CONCURRENCY = {
+    "api.etherscan.io": ETHERSCAN_CONCURRENCY,
+    "api.trongrid.io": 6,
+    "mempool.space": 6,
+    "api.binance.com": 2,
+}
+_host_sems = {host: threading.BoundedSemaphore(max(n, 1)) for host, n in HOST_CONCURRENCY.items()}
+
+def http_get(url, headers=None, timeout=15):
+    """GET url on SESSION, honouring a host's 429 Retry-After and raising HTTPError on 4xx/5xx."""
+    host = urlsplit(url).netloc
+    wait = _host_cooldown.get(host, 0) - time.monotonic()
+    if wait > 0:
+        raise requests.HTTPError(f"{host} rate limited, retry in {wait:.0f}s")
+    with _host_sems.get(host) or nullcontext():
+        r = SESSION.get(url, headers=headers, timeout=timeout)
+    if r.status_code == 429:
+        _host_cooldown[host] = time.monotonic() + _retry_after_sec(r)
+    if r.status_code != 304:
+        r.raise_for_status()
+    return r
+
+# _http_cache[cache_key or url] = (url, etag, last_modified, body_digest, parsed_json) for the last good response per URL, LRU order
+_http_cache = OrderedDict()
+_http_cache_lock = threading.Lock()
+HTTP_CACHE_MAX = 512
+
+def http_get_json(url, timeout=15, cache_key=None):
+    """
+    GET url and decode JSON; revalidates with If-None-Match/If-Modified-Since and reuses the body on 304.
+    Servers without validators still skip the decode when the body is byte-identical to the last one.
+    cache_key lets URLs that change every call (block ranges) share one entry; validators are per-URL,
+    so they are only sent when the entry came from this exact URL, and such calls just get the decode skip.
+    """
+    key = cache_key or url
+    with _http_cache_lock:
+        cached = _http_cache.get(key)
+        if cached:
+            _http_cache.move_to_end(key)
+    same_url = cached is not None and cached[0] == url
+    headers = {}
+    if same_url:
+        if cached[1]:
+            headers["If-None-Match"] = cached[1]
+        if cached[2]:
+            headers["If-Modified-Since"] = cached[2]
+    r = http_get(url, headers=headers, timeout=timeout)
+    if r.status_code == 304 and same_url:
+        return cached[4]
+    digest = hashlib.blake2b(r.content, digest_size=16).digest()
+    data = cached[4] if cached and cached[3] == digest else json_loads(r.content)
+    with _http_cache_lock:
+        _http_cache[key] = (url, r.headers.get("ETag"), r.headers.get("Last-Modified"), digest, data)
+        _http_cache.move_to_end(key)
+        if len(_http_cache) > HTTP_CACHE_MAX:
+            _http_cache.popitem(last=False)
+    return data
+
+PRICE_SYMBOLS = ("ETHUSDT", "BTCUSDT")
+# _price_cache[symbol] = (fetched_at monotonic, price); kept on fetch errors so alerts show the last good price
+_price_cache = {}
+_price_lock = threading.Lock()
+
+def get_prices(symbols=PRICE_SYMBOLS):
+    """Return {symbol: price}, refreshing every stale symbol with a single Binance call."""
+    with _price_lock:  # single flight: concurrent callers wait for one refresh instead of each fetching
+        now = time.monotonic()
+        stale = [s for s in symbols if s not in _price_cache or now - _price_cache[s][0] >= PRICE_CACHE_TTL]
+        if stale:
+            url = ("https://api.binance.com/api/v3/ticker/price?symbols="
+                   + quote(json.dumps(stale, separators=(",", ":"))))
+            try:
+                for row in json_loads(http_get(url, timeout=10).content):
+                    _price_cache[row["symbol"]] = (now, float(row["price"]))
+            except Exception as e:
+                log_error("Price fetch error", e)
+        return {s: _price_cache.get(s, (0, 0.0))[1] for s in symbols}
 
 def fmt_ts_local(epoch_sec):
     """Return local time string with label, e.g. '2025-08-10 23:37:11 北京时间'."""
@@ -106,41 +377,128 @@ ETH_CUTOFF_TS = parse_cutoff(ETH_CUTOFF_LOCAL, assume_local=True) or parse_cutof
 TRON_CUTOFF_TS = parse_cutoff(TRON_CUTOFF_LOCAL, assume_local=True) or parse_cutoff(TRON_CUTOFF_UTC) or GLOBAL_CUTOFF_TS
 
 # === ETH ===
-def get_latest_eth_tx(address):
-    url = ("https://api.etherscan.io/api"
-           f"?module=account&action=txlist&address={address}"
-           f"&sort=desc&apikey={ETHERSCAN_API_KEY}")
+# ETH_LAST_BLOCK / ERC20_LAST_BLOCK [address] = last block height fetched successfully for that action
+ETH_LAST_BLOCK = {}
+ERC20_LAST_BLOCK = {}
+
+def _etherscan_account_url(action, address):
+    return ("https://api.etherscan.io/api"
+            f"?module=account&action={action}&address={address}"
+            f"&page=1&offset={ETH_PAGE_SIZE}&sort=desc&apikey={ETHERSCAN_API_KEY}")
+
+# Per-wallet URLs are fixed for the life of the process; only the block range is appended per call
+ETH_BLOCK_NUMBER_URL = f"https://api.etherscan.io/api?module=proxy&action=eth_blockNumber&apikey={ETHERSCAN_API_KEY}"
+ETH_ACCOUNT_URLS = {(action, item["address"]): _etherscan_account_url(action, item["address"])
+                    for action in ("txlist", "tokentx") for item in ETH_ADDRESSES}
+
+ETH_BALANCEMULTI_MAX = 20  # addresses per balancemulti call (Etherscan limit)
+# ETH_BALANCES[address] = (wei balance string, chain tip when that balance was first seen)
+ETH_BALANCES = {}
+
+def get_eth_balances(addresses):
+    """{address: wei balance string} via balancemulti; addresses whose chunk failed are missing."""
+    balances = {}
+    for i in range(0, len(addresses), ETH_BALANCEMULTI_MAX):
+        url = ("https://api.etherscan.io/api?module=account&action=balancemulti"
+               f"&address={','.join(addresses[i:i + ETH_BALANCEMULTI_MAX])}&tag=latest&apikey={ETHERSCAN_API_KEY}")
+        try:
+            rows = http_get_json(url, timeout=15).get("result")
+            if not isinstance(rows, list):
+                raise ValueError(rows)
+            for row in rows:
+                balances[str(row.get("account", "")).lower()] = row.get("balance")
+        except Exception as e:
+            log_error("ETH balance error", e)
+    return balances
+
+def get_eth_block_number():
+    try:
+        r = json_loads(http_get(ETH_BLOCK_NUMBER_URL, timeout=10).content)
+        return int(r.get("result", "0x0"), 16)
+    except Exception as e:
+        log_error("ETH block number error", e)
+        return 0
+
+def _etherscan_incoming(action, address, cursors, endblock):
+    """
+    Txs (txlist/tokentx) sent to address (lowercase) in the first page, oldest first. With endblock
+    (chain tip), only blocks after the address cursor are scanned and the cursor is advanced to endblock on success.
+    """
+    base = url = ETH_ACCOUNT_URLS.get((action, address)) or _etherscan_account_url(action, address)
+    last = cursors.get(address, 0)
+    if endblock:
+        startblock = max(0, last + 1 - ETH_BLOCK_OVERLAP) if last else 0
+        url += f"&startblock={startblock}&endblock={endblock}"
+    # keyed without the block range: one entry per wallet, used only to skip decoding a repeated body
+    # (usually an empty result); a different range never revalidates against the last one
+    r = http_get_json(url, timeout=15, cache_key=base)
+    txs = r.get("result", [])
+    if not isinstance(txs, list):
+        raise ValueError(txs)
+    if endblock:
+        cursors[address] = endblock
+    # sort=desc: reverse so a range with several deposits alerts them in chain order
+    return [tx for tx in reversed(txs) if str(tx.get("to") or "").lower() == address]
+
+def get_eth_txs(address, endblock=0):
+    out = []
     try:
-        r = requests.get(url, timeout=15).json()
-        txs = r.get("result", [])
-        for tx in txs:
-            if str(tx.get("to", "")).lower() == address.lower():
-                ts = int(tx.get("timeStamp", "0"))
-                tx["_amount_eth"] = int(tx.get("value", "0")) / 1e18
-                tx["_time_local"] = fmt_ts_local(ts)
-                tx["_epoch"] = ts
-                tx["_from"] = tx.get("from", "")
-                tx["_to"] = tx.get("to", "")
-                tx["_hash"] = tx.get("hash", "")
-                return tx
+        for tx in _etherscan_incoming("txlist", address, ETH_LAST_BLOCK, endblock):
+            ts = int(tx.get("timeStamp", "0"))
+            tx["_amount_eth"] = int(tx.get("value", "0")) / 1e18
+            tx["_time_local"] = fmt_ts_local(ts)
+            tx["_epoch"] = ts
+            tx["_from"] = tx.get("from", "")
+            tx["_to"] = tx.get("to", "")
+            tx["_hash"] = tx.get("hash", "")
+            out.append(tx)
     except Exception as e:
-        print("ETH fetch error:", e)
-    return None
+        log_error("ETH fetch error", e)
+    return out
+
+def get_erc20_txs(address, endblock=0):
+    out = []
+    try:
+        for tx in _etherscan_incoming("tokentx", address, ERC20_LAST_BLOCK, endblock):
+            ts = int(tx.get("timeStamp", "0"))
+            decimals = int(tx.get("tokenDecimal") or 18)
+            out.append({
+                "_amount": int(tx.get("value", "0")) / (10 ** decimals),
+                "_symbol": tx.get("tokenSymbol") or "ERC20",
+                "_from": tx.get("from", ""),
+                "_to": tx.get("to", ""),
+                # one tx can move several tokens; key by contract too so each is notified
+                "_txid": f"{tx.get('hash', '')}:{tx.get('contractAddress', '')}",
+                "_hash": tx.get("hash", ""),
+                "_time_local": fmt_ts_local(ts),
+                "_epoch": ts,
+            })
+    except Exception as e:
+        log_error("ERC20 fetch error", e)
+    return out
 
 # === TRON (TRC20) ===
-def get_latest_tron_tx(address):
-    url = f"https://api.trongrid.io/v1/accounts/{address}/transactions/trc20?limit=10"
+def _trongrid_trc20_url(address):
+    return f"https://api.trongrid.io/v1/accounts/{address}/transactions/trc20?only_to=true&limit=3"
+
+TRON_URLS = {item["address"]: _trongrid_trc20_url(item["address"]) for item in TRON_ADDRESSES}
+
+def get_tron_txs(address):
+    """TRC20 transfers to address in the first page, oldest first."""
+    url = TRON_URLS.get(address) or _trongrid_trc20_url(address)
+    out = []
     try:
-        r = requests.get(url, timeout=15).json()
+        r = http_get_json(url, timeout=15)
         txs = r.get("data", []) or []
-        for tx in txs:
+        for tx in reversed(txs):
             if tx.get("to") == address:
-                decimals = int(tx.get("token_info", {}).get("decimals", 6))
+                token_info = tx.get("token_info") or {}
+                decimals = int(token_info.get("decimals", 6))
                 val = int(tx.get("value", "0")) / (10 ** decimals)
-                symbol = tx.get("token_info", {}).get("symbol", "TRC20")
+                symbol = token_info.get("symbol", "TRC20")
                 ts_ms = int(tx.get("block_timestamp", 0))
                 ts = int(ts_ms // 1000) if ts_ms else 0
-                return {
+                out.append({
                     "_amount": val,
                     "_symbol": symbol,
                     "_from": tx.get("from", ""),
@@ -148,89 +506,382 @@ def get_latest_tron_tx(address):
                     "_txid": tx.get("transaction_id", ""),
                     "_time_local": fmt_ts_local(ts),
                     "_epoch": ts,
-                }
+                })
     except Exception as e:
-        print("TRON fetch error:", e)
-    return None
+        log_error("TRON fetch error", e)
+    return out
 
 # === BTC via mempool.space ===
 def _sum_outputs_to_address_btc(tx, address):
-    total_sats = 0
-    for vout in tx.get("vout", []):
-        if vout.get("scriptpubkey_address") == address:
-            total_sats += int(vout.get("value", 0))
-    return total_sats / 1e8
+    """Total satoshis (int) paid to address by tx."""
+    return sum(int(vout.get("value", 0)) for vout in tx.get("vout") or ()
+               if vout.get("scriptpubkey_address") == address)
 
 def _first_input_from_address_btc(tx):
+    return next((vin["prevout"]["scriptpubkey_address"] for vin in tx.get("vin") or ()
+                 if (vin.get("prevout") or {}).get("scriptpubkey_address")), "不明")
+
+# _first_seen_cache[txid] = first-seen epoch; it never changes, so entries are only evicted oldest-first for size
+_first_seen_cache = OrderedDict()
+_first_seen_lock = threading.Lock()
+FIRST_SEEN_CACHE_MAX = 4096
+
+def _btc_first_seen_epochs(txids):
+    """{txid: first-seen epoch}, looking up only uncached txids in one transaction-times call; {} when disabled."""
+    if not BTC_USE_FIRST_SEEN or not txids:
+        return {}
+    with _first_seen_lock:
+        found = {t: _first_seen_cache[t] for t in txids if t in _first_seen_cache}
+    missing = [t for t in txids if t not in found]
+    if not missing:
+        return found
+    url = "https://mempool.space/api/v1/transaction-times?" + "&".join(f"txId[]={t}" for t in missing)
     try:
-        vin0 = tx.get("vin", [])[0]
-        prev = vin0.get("prevout", {})
-        return prev.get("scriptpubkey_address") or "不明"
+        times = json_loads(http_get(url, timeout=10).content)
+        fetched = {t: int(v) for t, v in zip(missing, times) if v and int(v) > 0}
     except Exception:
-        return "不明"
-
-def _btc_first_seen_epoch(txid):
-    if not BTC_USE_FIRST_SEEN:
-        return int(time.time())
-    try:
-        j = requests.get(f"https://mempool.space/api/tx/{txid}", timeout=10).json()
-        v = j.get("firstSeen") or j.get("received") or j.get("timestamp") or 0
-        v = int(v)
-        if v > 10**12:  # ms -> s
-            v //= 1000
-        return v if v > 0 else int(time.time())
-    except Exception:
-        return int(time.time())
+        return found
+    with _first_seen_lock:
+        _first_seen_cache.update(fetched)
+        while len(_first_seen_cache) > FIRST_SEEN_CACHE_MAX:
+            _first_seen_cache.popitem(last=False)
+    found.update(fetched)
+    return found
+
+def _btc_records(txs, address, confirmed=None, limit=None):
+    """
+    Incoming-tx records for address from mempool.space tx objects (at most limit of them).
+    confirmed=None reads each tx's own status, as returned by the combined /txs endpoint.
+    """
+    incoming = []
+    for tx in txs or []:
+        sats = _sum_outputs_to_address_btc(tx, address)
+        if sats > 0:
+            is_confirmed = confirmed if confirmed is not None else bool((tx.get("status") or {}).get("confirmed"))
+            incoming.append((tx, sats, is_confirmed))
+            if limit is not None and len(incoming) >= limit:
+                break
+    # websocket mempool txs carry firstSeen inline; only the REST ones need a transaction-times lookup
+    first_seen = _btc_first_seen_epochs([tx.get("txid", "") for tx, _, conf in incoming
+                                         if not conf and not tx.get("firstSeen")])
+    now = int(time.time())
+    records = []
+    for tx, sats, is_confirmed in incoming:
+        txid = tx.get("txid", "")
+        if is_confirmed:
+            status = tx.get("status", {}) or {}
+            epoch = int(status.get("block_time", 0)) or now
+        else:
+            inline = int(tx.get("firstSeen") or 0) if BTC_USE_FIRST_SEEN else 0
+            epoch = inline or first_seen.get(txid) or now
+        records.append({
+            "_sats": sats,
+            "_amount_btc": sats / 1e8,
+            "_from": _first_input_from_address_btc(tx),
+            "_to": address,
+            "_txid": txid,
+            "_time_local": fmt_ts_local(epoch),
+            "_epoch": epoch,
+            "_confirmed": is_confirmed,
+        })
+    return records
+
+def _mempool_address_url(address):
+    return f"https://mempool.space/api/address/{address}/txs"
+
+BTC_URLS = {item["address"]: _mempool_address_url(item["address"]) for item in BTC_ADDRESSES}
 
 def get_btc_txs_mempool(address, max_items=25):
-    base = "https://mempool.space/api/address"
-    results = []
-
-    # Unconfirmed
+    """Unconfirmed then newest confirmed incoming txs, from one /address/{address}/txs call."""
+    url = BTC_URLS.get(address) or _mempool_address_url(address)
     try:
-        mem_txs = requests.get(f"{base}/{address}/txs/mempool", timeout=15).json()
-        for tx in mem_txs or []:
-            amount_btc = _sum_outputs_to_address_btc(tx, address)
-            if amount_btc > 0:
-                txid = tx.get("txid", "")
-                epoch = _btc_first_seen_epoch(txid)
-                results.append({
-                    "_amount_btc": amount_btc,
-                    "_from": _first_input_from_address_btc(tx),
-                    "_to": address,
-                    "_txid": txid,
-                    "_time_local": fmt_ts_local(epoch),
-                    "_epoch": epoch,
-                    "_confirmed": False,
-                })
-            if len(results) >= max_items:
-                break
+        return _btc_records(http_get_json(url, timeout=15), address, limit=max_items)
     except Exception as e:
-        print("BTC mempool fetch error:", e)
-
-    # Confirmed
+        log_error("BTC fetch error", e)
+        return []
+
+# === BTC push via mempool.space websocket ===
+# live: subscribed and receiving; resync: a REST pass is still owed for the gap before (re)subscribing
+BTC_WS = {"live": False, "resync": True}
+BTC_WS_QUEUE = queue.Queue()
+BTC_WS_RETRY_SEC = 10
+BTC_WS_RETRY_MAX_SEC = 300  # reconnect delay doubles per failed attempt up to this
+
+def _btc_ws_handle(msg, addresses):
+    """Queue (address, record) pairs for every incoming tx in a websocket message."""
+    if len(addresses) == 1:
+        addr = addresses[0]
+        batches = [(addr, msg.get("address-transactions") or [], False),
+                   (addr, msg.get("block-transactions") or [], True)]
+    else:
+        batches = []
+        for addr, events in (msg.get("multi-address-transactions") or {}).items():
+            batches.append((addr, events.get("mempool") or [], False))
+            batches.append((addr, events.get("confirmed") or [], True))
+    for addr, txs, confirmed in batches:
+        for rec in _btc_records(txs, addr, confirmed):
+            BTC_WS_QUEUE.put((addr, rec))
+
+def _btc_ws_loop(addresses):
+    if len(addresses) == 1:
+        subscribe = {"track-address": addresses[0]}
+    else:
+        subscribe = {"track-addresses": addresses}
+    delay = BTC_WS_RETRY_SEC
+    while True:
+        ws = None
+        try:
+            ws = websocket.create_connection(BTC_WS_URL, timeout=30)
+            ws.send(json_dumps(subscribe).decode())
+            BTC_WS["resync"] = True
+            BTC_WS["live"] = True
+            while True:
+                try:
+                    raw = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    ws.ping()  # idle addresses get no frames; keep the connection provably alive
+                    continue
+                delay = BTC_WS_RETRY_SEC  # server is talking to us again
+                msg = json_loads(raw) if raw else {}
+                err = msg.get("track-address-error") or msg.get("track-addresses-error")
+                if err:
+                    print("BTC websocket subscribe error, using REST polling:", err)
+                    return
+                _btc_ws_handle(msg, addresses)
+        except Exception as e:
+            log_error("BTC websocket error", e)
+        finally:
+            BTC_WS["live"] = False
+            if ws is not None:
+                try:
+                    ws.close()
+                except Exception:
+                    pass
+        time.sleep(delay)
+        delay = min(delay * 2, BTC_WS_RETRY_MAX_SEC)
+
+def btc_ws_drain():
+    """Pop everything pushed since the last cycle, grouped as {address: [record, ...]}."""
+    out = defaultdict(list)
+    while True:
+        try:
+            addr, rec = BTC_WS_QUEUE.get_nowait()
+        except queue.Empty:
+            return out
+        out[addr].append(rec)
+
+# === Alert templates (filled with str.format_map) ===
+ETH_TEMPLATE = (
+    "*[ETH] 入金*\n"
+    "账户{name_line}\n"
+    "我们地址: `{to}`\n"
+    "客户地址: `{frm}`\n"
+    "时间: {time}\n"
+    "💰 {amount:.6f} ETH ≈ ${usd:,.2f}\n"
+    "TXID: `{txid}`"
+)
+TOKEN_TEMPLATE = (
+    "*[{chain}] 入金*\n"
+    "账户{name_line}\n"
+    "我们地址: `{to}`\n"
+    "客户地址: `{frm}`\n"
+    "时间: {time}\n"
+    "💰 {amount} {symbol}\n"
+    "TXID: `{txid}`"
+)
+BTC_TEMPLATE = (
+    "*[BTC] {title}*\n"
+    "账户{name_line}\n"
+    "状态: {status}\n"
+    "我们地址: `{to}`\n"
+    "客户地址: `{frm}`\n"
+    "时间: {time}\n"
+    "💰 {amount:.8f} BTC ≈ ${usd:,.2f}\n"
+    "TXID: `{txid}`"
+)
+
+def _tx_view(tx, label, **extra):
+    """Fields shared by every alert template."""
+    view = {
+        "name_line": f"（{label}）" if label else "",
+        "to": tx["_to"],
+        "frm": tx["_from"],
+        "time": tx["_time_local"],
+    }
+    view.update(extra)
+    return view
+
+# === Seen-tx state (SQLite) ===
+def open_state_db(path=STATE_DB):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS seen("
+        "chain TEXT, addr TEXT, txid TEXT, confirmed INTEGER, ts INTEGER,"
+        " PRIMARY KEY(chain, addr, txid))"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS cursor(chain TEXT, addr TEXT, block INTEGER, PRIMARY KEY(chain, addr))"
+    )
+    return conn
+
+def load_seen(conn):
+    """Rebuild seen[(chain, address)][txid] from disk so a restart does not re-notify old txs."""
+    seen = defaultdict(OrderedDict)
+    for chain, addr, txid, confirmed, ts in conn.execute(
+            "SELECT chain, addr, txid, confirmed, ts FROM seen ORDER BY ts"):
+        remember_tx(seen[(chain, addr)], txid, bool(confirmed), ts)
+    return seen
+
+def remember_tx(entries, txid, confirmed, ts):
+    """Insert into one wallet's OrderedDict, evicting the oldest entries beyond SEEN_LIMIT."""
+    entries[txid] = ts << 1 | int(confirmed)  # packed: one int per txid instead of a dict
+    entries.move_to_end(txid)
+    while len(entries) > SEEN_LIMIT:
+        entries.popitem(last=False)
+
+# Etherscan block cursors survive restarts, so a restart resumes from startblock instead of rescanning history
+CURSORS = {"eth": ETH_LAST_BLOCK, "erc20": ERC20_LAST_BLOCK}
+_saved_cursors = {}
+
+def load_cursors(conn):
+    for chain, addr, block in conn.execute("SELECT chain, addr, block FROM cursor"):
+        if chain in CURSORS:
+            CURSORS[chain][addr] = block
+            _saved_cursors[(chain, addr)] = block
+
+def save_cursors(conn):
+    """
+    Write the cursors that moved since the last save. A wallet with alerts still undelivered keeps its
+    saved cursor, so a restart rescans those blocks and re-alerts instead of starting past them.
+    """
+    rows = [(chain, addr, block) for chain, blocks in CURSORS.items() for addr, block in blocks.items()
+            if _saved_cursors.get((chain, addr)) != block and (chain, addr) not in _tg_undelivered]
+    if not rows:
+        return
     try:
-        chain_txs = requests.get(f"{base}/{address}/txs/chain", timeout=15).json()
-        for tx in chain_txs or []:
-            amount_btc = _sum_outputs_to_address_btc(tx, address)
-            if amount_btc > 0:
-                status = tx.get("status", {}) or {}
-                block_time = int(status.get("block_time", 0)) or int(time.time())
-                results.append({
-                    "_amount_btc": amount_btc,
-                    "_from": _first_input_from_address_btc(tx),
-                    "_to": address,
-                    "_txid": tx.get("txid", ""),
-                    "_time_local": fmt_ts_local(block_time),
-                    "_epoch": block_time,
-                    "_confirmed": True,
-                })
-            if len(results) >= max_items:
-                break
-    except Exception as e:
-        print("BTC chain fetch error:", e)
+        conn.execute("BEGIN")
+        conn.executemany("INSERT OR REPLACE INTO cursor VALUES (?, ?, ?)", rows)
+        conn.execute("COMMIT")
+        _saved_cursors.update(((chain, addr), block) for chain, addr, block in rows)
+    except sqlite3.Error as e:
+        log_error("Cursor save error", e)
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+
+# Trimming old rows and checkpointing the WAL are housekeeping only (memory is bounded by remember_tx),
+# so they run at most every STATE_PRUNE_SEC
+_prune = {"last": None, "pending": set()}
+
+def save_seen(conn, rows):
+    """Upsert delivered (chain, addr, txid, confirmed, ts) rows in one transaction; trim to SEEN_LIMIT periodically."""
+    if not rows:
+        return
+    _prune["pending"].update((r[0], r[1]) for r in rows)
+    now = time.monotonic()
+    prune = _prune["last"] is None or now - _prune["last"] >= STATE_PRUNE_SEC
+    try:
+        conn.execute("BEGIN")
+        conn.executemany("INSERT OR REPLACE INTO seen VALUES (?, ?, ?, ?, ?)", rows)
+        if prune:
+            for chain, addr in _prune["pending"]:
+                conn.execute(
+                    "DELETE FROM seen WHERE chain=? AND addr=? AND txid NOT IN"
+                    " (SELECT txid FROM seen WHERE chain=? AND addr=? ORDER BY ts DESC LIMIT ?)",
+                    (chain, addr, chain, addr, SEEN_LIMIT),
+                )
+        conn.execute("COMMIT")
+        if prune:
+            # fold the WAL back into the main file and truncate it so it cannot grow between restarts
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            _prune["last"] = now
+            _prune["pending"].clear()
+    except sqlite3.Error as e:
+        log_error("State save error", e)
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+
+# === Poll schedule ===
+# keyed by (chain, address) on the monotonic clock; a wallet is re-polled quickly while active and backs off while idle
+_poll_interval = {}
+_poll_next = {}
+
+def poll_due(key, now):
+    return _poll_next.get(key, 0) <= now
+
+def poll_reschedule(key, active, now):
+    if active:
+        interval = POLL_INTERVAL
+    else:
+        interval = min(_poll_interval.get(key, POLL_INTERVAL) * POLL_BACKOFF, POLL_MAX_INTERVAL)
+    _poll_interval[key] = interval
+    _poll_next[key] = now + interval
+
+def poll_sleep_seconds(now):
+    """Sleep until the next wallet is due, but at least every POLL_INTERVAL (websocket queue drain)."""
+    next_due = min(_poll_next.values(), default=now + POLL_INTERVAL)
+    return max(0.5, min(next_due - now, POLL_INTERVAL))
+
+# === Alert handlers ===
+# cycle = {"seen", "active", "prices", "ts"}: the per-cycle state every handler reads and appends to
+def _alert(cycle, chain, addr, txid, confirmed, msg):
+    send_message(msg, [(chain, addr, txid, int(confirmed), cycle["ts"])])
+    remember_tx(cycle["seen"][(chain, addr)], txid, confirmed, cycle["ts"])
+    cycle["active"].add((chain, addr))
+
+def _new_txs(txs, entries, key, cutoff_ts):
+    """Unseen txs past the cutoff, oldest first; a wallet with no history yet only alerts its newest one."""
+    txs = [tx for tx in txs or () if not (cutoff_ts and tx["_epoch"] and tx["_epoch"] < cutoff_ts)]
+    if not entries:
+        txs = txs[-1:]
+    return [tx for tx in txs if tx[key] not in entries]
+
+def handle_eth(cycle, item, txs):
+    addr = item["address"]
+    for tx in _new_txs(txs, cycle["seen"][("eth", addr)], "_hash", ETH_CUTOFF_TS):
+        usd = tx["_amount_eth"] * cycle["prices"]["ETHUSDT"]
+        _alert(cycle, "eth", addr, tx["_hash"], True, ETH_TEMPLATE.format_map(_tx_view(
+            tx, item["label"], amount=tx["_amount_eth"], usd=usd, txid=tx["_hash"])))
+
+def handle_erc20(cycle, item, txs):
+    addr = item["address"]
+    for tx in _new_txs(txs, cycle["seen"][("erc20", addr)], "_txid", ETH_CUTOFF_TS):
+        _alert(cycle, "erc20", addr, tx["_txid"], True, TOKEN_TEMPLATE.format_map(_tx_view(
+            tx, item["label"], chain="ERC20", amount=tx["_amount"], symbol=tx["_symbol"], txid=tx["_hash"])))
+
+def handle_tron(cycle, item, txs):
+    addr = item["address"]
+    for tx in _new_txs(txs, cycle["seen"][("tron", addr)], "_txid", TRON_CUTOFF_TS):
+        _alert(cycle, "tron", addr, tx["_txid"], True, TOKEN_TEMPLATE.format_map(_tx_view(
+            tx, item["label"], chain="TRC20", amount=tx["_amount"], symbol=tx["_symbol"], txid=tx["_txid"])))
+
+def _btc_view(tx, label, btc_price, **extra):
+    return _tx_view(tx, label, amount=tx["_amount_btc"], usd=tx["_amount_btc"] * btc_price, txid=tx["_txid"], **extra)
+
+def handle_btc(cycle, addr, txs):
+    """txs: REST or websocket records for addr; alerts new txs and (optionally) their confirmation."""
+    entries = cycle["seen"][("btc", addr)]
+    btc_price = cycle["prices"]["BTCUSDT"]
+    for label in BTC_LABELS.get(addr, ()):
+        for tx in txs or ():
+            if BTC_CUTOFF_TS and tx["_epoch"] and tx["_epoch"] < BTC_CUTOFF_TS:
+                continue
 
-    return results
+            # the view is only built for txs that actually alert; already-seen txs are the common case
+            prev = entries.get(tx["_txid"])
+            if prev is None:
+                status = "已确认 ✅" if tx["_confirmed"] else "未确认 ⏳"
+                _alert(cycle, "btc", addr, tx["_txid"], tx["_confirmed"],
+                       BTC_TEMPLATE.format_map(_btc_view(tx, label, btc_price, title="入金", status=status)))
+            elif BTC_CONFIRM_UPDATE and not prev & 1 and tx["_confirmed"]:
+                send_message(BTC_TEMPLATE.format_map(_btc_view(tx, label, btc_price, title="状态更新", status="已确认 ✅")),
+                             [("btc", addr, tx["_txid"], 1, prev >> 1)])
+                entries[tx["_txid"]] = prev | 1
+                entries.move_to_end(tx["_txid"])
+                cycle["active"].add(("btc", addr))
+
+HANDLERS = {"eth": handle_eth, "erc20": handle_erc20, "tron": handle_tron, "btc": handle_btc}
 
 # === Main loop ===
 def main():
@@ -239,116 +890,94 @@ def main():
     if not ETHERSCAN_API_KEY and ETH_ADDRESSES:
         print("⚠️ ETHERSCAN_API_KEY not set; ETH monitoring may fail.")
 
-    # seen[address] = { txid: {"confirmed": bool, "ts": int} }
-    seen = defaultdict(dict)
+    threading.Thread(target=_telegram_sender, name="telegram", daemon=True).start()
 
-    while True:
-        eth_price = get_price("ETHUSDT")
-        btc_price = get_price("BTCUSDT")
-
-        # --- ETH ---
-        for item in ETH_ADDRESSES:
-            addr = item["address"].strip()
-            label = item["label"]
-            if not addr:
-                continue
-            tx = get_latest_eth_tx(addr)
-            if tx:
-                if ETH_CUTOFF_TS and tx["_epoch"] and tx["_epoch"] < ETH_CUTOFF_TS:
-                    continue
-                if tx["_hash"] not in seen[addr]:
-                    usd = tx["_amount_eth"] * eth_price
-                    name_line = f"（{label}）" if label else ""
-                    msg = (
-                        f"*[ETH] 入金*\n"
-                        f"账户{name_line}\n"
-                        f"我们地址: `{tx['_to']}`\n"
-                        f"客户地址: `{tx['_from']}`\n"
-                        f"时间: {tx['_time_local']}\n"
-                        f"💰 {tx['_amount_eth']:.6f} ETH ≈ ${usd:,.2f}\n"
-                        f"TXID: `{tx['_hash']}`"
-                    )
-                    send_message(msg)
-                    seen[addr][tx["_hash"]] = {"confirmed": True, "ts": int(time.time())}
-
-        # --- TRON (TRC20) ---
-        for item in TRON_ADDRESSES:
-            addr = item["address"].strip()
-            label = item["label"]
-            if not addr:
-                continue
-            tx = get_latest_tron_tx(addr)
-            if tx:
-                if TRON_CUTOFF_TS and tx["_epoch"] and tx["_epoch"] < TRON_CUTOFF_TS:
-                    continue
-                if tx["_txid"] not in seen[addr]:
-                    name_line = f"（{label}）" if label else ""
-                    msg = (
-                        f"*[TRC20] 入金*\n"
-                        f"账户{name_line}\n"
-                        f"我们地址: `{tx['_to']}`\n"
-                        f"客户地址: `{tx['_from']}`\n"
-                        f"时间: {tx['_time_local']}\n"
-                        f"💰 {tx['_amount']} {tx['_symbol']}\n"
-                        f"TXID: `{tx['_txid']}`"
-                    )
-                    send_message(msg)
-                    seen[addr][tx["_txid"]] = {"confirmed": True, "ts": int(time.time())}
-
-        # --- BTC ---
-        for item in BTC_ADDRESSES:
-            addr = item["address"].strip()
-            label = item["label"]
-            if not addr:
-                continue
-
-            txs = get_btc_txs_mempool(addr)
-            if not txs:
-                continue
+    btc_ws_addrs = list(BTC_WALLETS)
+    if btc_ws_addrs and BTC_WEBSOCKET:
+        if websocket is None:
+            print("⚠️ websocket-client not installed; BTC falls back to REST polling.")
+        else:
+            threading.Thread(target=_btc_ws_loop, args=(btc_ws_addrs,), name="btc-ws", daemon=True).start()
 
-            for tx in txs:
-                if BTC_CUTOFF_TS and tx["_epoch"] and tx["_epoch"] < BTC_CUTOFF_TS:
-                    continue
+    # seen[(chain, address)] = OrderedDict{ txid: ts << 1 | confirmed }, persisted in STATE_DB
+    state_db = open_state_db()
+    seen = load_seen(state_db)
+    load_cursors(state_db)
 
-                prev = seen[addr].get(tx["_txid"])
-                name_line = f"（{label}）" if label else ""
-                status_line = "已确认 ✅" if tx["_confirmed"] else "未确认 ⏳"
-                usd_val = tx["_amount_btc"] * btc_price
-
-                if not prev:
-                    msg = (
-                        f"*[BTC] 入金*\n"
-                        f"账户{name_line}\n"
-                        f"状态: {status_line}\n"
-                        f"我们地址: `{tx['_to']}`\n"
-                        f"客户地址: `{tx['_from']}`\n"
-                        f"时间: {tx['_time_local']}\n"
-                        f"💰 {tx['_amount_btc']:.8f} BTC ≈ ${usd_val:,.2f}\n"
-                        f"TXID: `{tx['_txid']}`"
-                    )
-                    send_message(msg)
-                    seen[addr][tx["_txid"]] = {"confirmed": tx["_confirmed"], "ts": int(time.time())}
-                else:
-                    if BTC_CONFIRM_UPDATE and (not prev["confirmed"]) and tx["_confirmed"]:
-                        msg = (
-                            f"*[BTC] 状态更新*\n"
-                            f"账户{name_line}\n"
-                            f"状态: 已确认 ✅\n"
-                            f"我们地址: `{tx['_to']}`\n"
-                            f"客户地址: `{tx['_from']}`\n"
-                            f"时间: {tx['_time_local']}\n"
-                            f"💰 {tx['_amount_btc']:.8f} BTC ≈ ${usd_val:,.2f}\n"
-                            f"TXID: `{tx['_txid']}`"
-                        )
-                        send_message(msg)
-                        prev["confirmed"] = True
-
-            # cleanup
-            if len(seen[addr]) > SEEN_LIMIT:
-                for txid in sorted(seen[addr], key=lambda k: seen[addr][k]["ts"])[:-SEEN_LIMIT]:
-                    seen[addr].pop(txid, None)
-
-        time.sleep(5)
+    while True:
+        polled = set()  # (chain, addr) keys fetched this cycle
+        active = set()  # (chain, addr) keys that produced an alert this cycle
+        now = time.monotonic()
+
+        # Fan out every due fetch of this cycle at once; meta[future] = (chain, wallet item or BTC address)
+        meta = {}
+        prices_fut = EXECUTOR.submit(get_prices)
+        eth_due = [i for i in ETH_ADDRESSES if poll_due(("eth", i["address"]), now)]
+        erc20_due = [i for i in ETH_ADDRESSES if ETH_ERC20 and poll_due(("erc20", i["address"]), now)]
+        eth_tip_fut = EXECUTOR.submit(get_eth_block_number) if eth_due or erc20_due else None
+        for item in TRON_ADDRESSES:
+            if poll_due(("tron", item["address"]), now):
+                meta[EXECUTOR.submit(get_tron_txs, item["address"])] = ("tron", item)
+        # BTC: REST poll only while the websocket is down or still owes a catch-up pass (then every wallet)
+        if not BTC_WS["live"] or BTC_WS["resync"]:
+            resync = BTC_WS["live"]
+            if resync:
+                BTC_WS["resync"] = False
+            for a in BTC_WALLETS:
+                if resync or poll_due(("btc", a), now):
+                    meta[EXECUTOR.submit(get_btc_txs_mempool, a)] = ("btc", a)
+        else:
+            # the websocket covers BTC; stale due times would otherwise pin the loop sleep to its floor
+            for a in BTC_WALLETS:
+                _poll_next.pop(("btc", a), None)
+        # ETH: only wallets whose cursor is behind the chain tip need a txlist call
+        eth_tip = eth_tip_fut.result() if eth_tip_fut else 0
+        eth_behind = []
+        for item in eth_due:
+            if eth_tip and ETH_LAST_BLOCK.get(item["address"], 0) >= eth_tip:
+                polled.add(("eth", item["address"]))  # no new block: counts as an idle poll
+            else:
+                eth_behind.append(item)
+        # ...and of those, only wallets whose balance moved (one balancemulti call per 20 wallets)
+        eth_balances = {}
+        if eth_tip and eth_behind:
+            eth_balances = get_eth_balances(list(dict.fromkeys(i["address"] for i in eth_behind)))
+        for item in eth_behind:
+            addr = item["address"]
+            balance = eth_balances.get(addr)
+            if balance is not None and ETH_BALANCES.get(addr, (None,))[0] != balance:
+                ETH_BALANCES[addr] = (balance, eth_tip)
+            # an unchanged balance is only trusted once a scan ran ETH_BLOCK_OVERLAP past the block it moved at,
+            # so a deposit a lagging txlist index missed is still picked up by the overlap
+            if balance is not None and ETH_LAST_BLOCK.get(addr, 0) >= ETH_BALANCES[addr][1] + ETH_BLOCK_OVERLAP:
+                ETH_LAST_BLOCK[addr] = eth_tip  # nothing arrived since the last scan
+                polled.add(("eth", addr))
+            else:
+                meta[EXECUTOR.submit(get_eth_txs, addr, eth_tip)] = ("eth", item)
+        for item in erc20_due:
+            if eth_tip and ERC20_LAST_BLOCK.get(item["address"], 0) >= eth_tip:
+                polled.add(("erc20", item["address"]))
+            else:
+                meta[EXECUTOR.submit(get_erc20_txs, item["address"], eth_tip)] = ("erc20", item)
+        for chain, target in meta.values():
+            polled.add((chain, target if chain == "btc" else target["address"]))
+        cycle = {"seen": seen, "active": active, "prices": prices_fut.result(),
+                 "ts": int(time.time())}  # wall-clock stamp for this cycle's seen rows
+
+        # Alert as each fetch lands, so one slow upstream does not hold back the others
+        for fut in as_completed(meta):
+            chain, target = meta[fut]
+            HANDLERS[chain](cycle, target, fut.result())
+        for a, recs in btc_ws_drain().items():
+            handle_btc(cycle, a, recs)
+
+        save_seen(state_db, tg_delivered_rows())
+        save_cursors(state_db)
+
+        now = time.monotonic()
+        for key in polled:
+            poll_reschedule(key, key in active, now)
+        time.sleep(poll_sleep_seconds(now))
 
 if __name__ == "__main__":
     main()